@@ -2,61 +2,103 @@ from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
 from kivy.clock import Clock
+from bisect import bisect_right
+from functools import lru_cache
 import numpy as np
-import pandas as pd # Still useful for reference data
+
+try:
+    from numba import njit, prange
+except ImportError: # Numba is optional, the kernel then runs as plain Python
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+# dtype of the contaminant level and factor arrays (double precision keeps 4-5 digit
+# levels exact to the displayed 2 decimals after repeated multiplies)
+LEVEL_DTYPE = np.float64
 
 # --- Data Definitions (More Detailed) ---
 
 class Contaminant:
     """Represents a type of water contaminant."""
+    __slots__ = ("name", "initial_level", "current_level", "unit")
+
     def __init__(self, name, initial_level, unit="units"):
         self.name = name
         self.initial_level = initial_level
         self.current_level = initial_level
         self.unit = unit
 
-    def reduce(self, percentage):
-        """Reduces the contaminant level by a given percentage."""
-        reduction_factor = 1 - (percentage / 100.0)
-        self.current_level *= reduction_factor
-        if self.current_level < 0.01: # Cap at near zero for display
-            self.current_level = 0.0
-        return percentage * self.initial_level / 100.0 # Return amount reduced
-
 class WaterQuality:
-    """Manages a collection of contaminants."""
+    """Manages a collection of contaminants.
+       Levels are stored as parallel arrays (one entry per contaminant) so that
+       removal, copying and the clearness check are single vector operations.
+    """
+    __slots__ = ("description", "names", "units", "name_to_idx", "initial", "current")
+
     def __init__(self, description=""):
         self.description = description
-        self.contaminants = {}
+        self.names = []
+        self.units = []
+        self.name_to_idx = {}
+        self.initial = np.empty(0, dtype=LEVEL_DTYPE)
+        self.current = np.empty(0, dtype=LEVEL_DTYPE)
 
     def add_contaminant(self, contaminant: Contaminant):
-        self.contaminants[contaminant.name] = contaminant
+        idx = self.name_to_idx.get(contaminant.name)
+        if idx is not None: # Replace an existing entry in place
+            self.units[idx] = contaminant.unit
+            self.initial[idx] = contaminant.initial_level
+            self.current[idx] = contaminant.current_level
+            return
+        self.name_to_idx[contaminant.name] = len(self.names)
+        self.names.append(contaminant.name)
+        self.units.append(contaminant.unit)
+        self.initial = np.append(self.initial, np.array([contaminant.initial_level], dtype=LEVEL_DTYPE))
+        self.current = np.append(self.current, np.array([contaminant.current_level], dtype=LEVEL_DTYPE))
 
     def get_contaminant_level(self, name):
-        return self.contaminants.get(name, Contaminant(name, 0)).current_level
+        idx = self.name_to_idx.get(name)
+        return self.current[idx] if idx is not None else 0.0
 
     def get_all_levels(self):
-        return {name: cont.current_level for name, cont in self.contaminants.items()}
+        return dict(zip(self.names, self.current.tolist()))
+
+    def removal_factor(self, removal_efficiencies: dict):
+        """Builds the per-contaminant multiplier for the given efficiencies.
+           Contaminants not listed are left untouched (factor 1.0).
+        """
+        factor = np.ones(len(self.names), dtype=LEVEL_DTYPE)
+        for name, efficiency in removal_efficiencies.items():
+            idx = self.name_to_idx.get(name)
+            if idx is not None:
+                factor[idx] = 1 - (efficiency / 100.0)
+        return factor
 
     def apply_removal(self, removal_efficiencies: dict):
         """Applies removal efficiencies to current contaminant levels.
            removal_efficiencies: {contaminant_name: percentage_removal}
         """
-        for name, efficiency in removal_efficiencies.items():
-            if name in self.contaminants:
-                self.contaminants[name].reduce(efficiency)
+        self.current *= self.removal_factor(removal_efficiencies)
+        self.current[self.current < 0.01] = 0.0 # Cap at near zero for display
 
     def copy(self):
         """Creates a deep copy of the WaterQuality object."""
         new_wq = WaterQuality(self.description + " (Copy)")
-        for name, cont in self.contaminants.items():
-            new_cont = Contaminant(cont.name, cont.initial_level, cont.unit)
-            new_cont.current_level = cont.current_level
-            new_wq.add_contaminant(new_cont)
+        new_wq.names = list(self.names)
+        new_wq.units = list(self.units)
+        new_wq.name_to_idx = dict(self.name_to_idx)
+        new_wq.initial = self.initial.copy()
+        new_wq.current = self.current.copy()
         return new_wq
 
 class FiltrationMaterial:
     """Defines properties and effectiveness of a filter material."""
+    __slots__ = ("name", "description", "efficiency", "effect_on_flow", "draw_moisture")
+
     def __init__(self, name, description, efficiency: dict, effect_on_flow: float, draw_moisture=False):
         self.name = name
         self.description = description
@@ -105,6 +147,9 @@ sand_filter = FiltrationMaterial(
     draw_moisture=True # Key for drawing water from ground
 )
 
+# Reference data printed at startup
+filtration_materials = [charcoal_filter, gravel_filter, sand_filter]
+
 # Reference for distillation
 distillation_process = FiltrationMaterial(
     "Distillation (Evaporation/Condensation)",
@@ -123,7 +168,57 @@ distillation_process = FiltrationMaterial(
 )
 
 
+# --- Simulation Kernel (numeric work only, no Kivy objects) ---
+
+@njit(cache=True, fastmath=True)
+def _tick(raw, initial, distilled, total_factor, ground_moisture, draw_rates, drawn):
+    """Advances the water states by one step, updating the arrays in place.
+       total_factor is the combined filtration and distillation factor.
+       draw_rates holds the per-step draw of each capillary layer; the amount
+       actually drawn by each is written to drawn.
+       Returns the remaining ground moisture.
+    """
+    # 1. Capillary action re-introduces a portion of the initial contaminants
+    for j in range(draw_rates.shape[0]):
+        if ground_moisture > 0:
+            draw_amount = min(draw_rates[j], ground_moisture) # Don't draw more than is left
+            ground_moisture -= draw_amount
+            drawn[j] = draw_amount
+            # 1% of the initial level per 0.05 units drawn, never above the initial level
+            alpha = LEVEL_DTYPE(0.01 * draw_amount / 0.05) # Same dtype as the level arrays
+            np.minimum(initial, raw + initial * alpha, raw)
+        else:
+            drawn[j] = 0.0
+
+    # 2. Physical filtration and distillation in a single pass
+    # (both factors are <= 1, so clamping once at the end matches clamping after each stage)
+    np.multiply(raw, total_factor, distilled)
+    for i in range(distilled.shape[0]):
+        if distilled[i] < 0.01: # Cap at near zero for display
+            distilled[i] = 0.0
+
+    return ground_moisture
+
+
+@njit(cache=True, parallel=True, fastmath=True)
+def _tick_batch(raw, initial, distilled, total_factor, ground_moisture, draw_rates, drawn):
+    """Advances K independent stills by one step, one row of each 2-D array per still.
+       raw, initial, distilled and total_factor are (K, contaminants), ground_moisture
+       is (K,) and updated in place, drawn is (K, capillary layers).
+       Meant for parameter sweeps, e.g. one total_factor row per temperature; the
+       app itself simulates a single still with _tick.
+    """
+    for k in prange(raw.shape[0]):
+        ground_moisture[k] = _tick(raw[k], initial[k], distilled[k], total_factor[k],
+                                   ground_moisture[k], draw_rates, drawn[k])
+
+
 class SolarDistillationSimulator(BoxLayout):
+    CONTAMINANT_DISPLAY_INTERVAL = 4 # Refresh the contaminant label every N steps
+    # Clarity below CLARITY_THRESHOLDS[i] gets CLARITY_STATUSES[i], anything above the last gets the last status
+    CLARITY_THRESHOLDS = (0.3, 0.6, 0.9)
+    CLARITY_STATUSES = ("(Very Dirty)", "(Cloudy)", "(Clearing Up)", "(Clear!)")
+
     def __init__(self, **kwargs):
         super().__init__(orientation='vertical', **kwargs)
         self.temperature = 40  # Initial temperature (Celsius)
@@ -132,7 +227,6 @@ class SolarDistillationSimulator(BoxLayout):
 
         # --- Water Quality States ---
         self.raw_water_quality = self._initialize_bad_water()
-        self.filtered_water_quality = WaterQuality("Pre-Distillation Filtered Water")
         self.distilled_water_quality = WaterQuality("Final Distilled Water")
 
         # --- Filtration Layers in the Still (order matters for physical filters) ---
@@ -141,7 +235,23 @@ class SolarDistillationSimulator(BoxLayout):
             sand_filter, # Sand on top of gravel in some designs, or below if drawing from ground
             charcoal_filter
         ]
-        self.ground_moisture_level = 100 # Simulating initial ground moisture content (arbitrary units)
+        # The layers are fixed, so fold their efficiencies into one per-contaminant factor
+        self._combined_filter_factor = np.ones(len(self.raw_water_quality.names), dtype=LEVEL_DTYPE)
+        for material in self.filtration_layers:
+            self._combined_filter_factor *= self.raw_water_quality.removal_factor(material.efficiency)
+        # The layers never change, so their part of the step message is built once
+        self._filtration_message = "Applying Physical Filtration (Gravel, Sand, Charcoal):\n" + "".join(
+            f"  - Applied {material.name} filter. Flow effect: {material.effect_on_flow:.1f}\n"
+            for material in self.filtration_layers
+        )
+        # Layers that wick water from the ground, with their per-step draw
+        self._capillary_layers = [material for material in self.filtration_layers if material.draw_moisture]
+        self._capillary_draw_rates = np.array([0.05 * material.effect_on_flow # Adjust for realism
+                                               for material in self._capillary_layers])
+        self._capillary_drawn = np.zeros(len(self._capillary_layers))
+        # Simulating initial ground moisture content (arbitrary units)
+        # Kept a float so the kernel always sees (and returns) the same type
+        self.ground_moisture_level = 100.0
 
         # --- UI Elements ---
         self.add_widget(Label(text="--- Solar Distillation Simulation ---"))
@@ -169,30 +279,77 @@ class SolarDistillationSimulator(BoxLayout):
         self.time_step = 0
         self.sim_running = True
         self.raw_water_quality = self._initialize_bad_water() # Reset for restart
-        self.filtered_water_quality = WaterQuality("Pre-Distillation Filtered Water") # Reset
-        self.distilled_water_quality = WaterQuality("Final Distilled Water") # Reset
-
+        # The distilled state is allocated once here and overwritten in place every step
+        self.distilled_water_quality = self.raw_water_quality.copy() # Reset
+        self.distilled_water_quality.description = "Final Distilled Water"
+        self._raw_current = self.raw_water_quality.current
+        self._raw_initial = self.raw_water_quality.initial
+        # Water counts as clear once every contaminant is below 1% of its initial level
+        self._clear_thresholds = 0.01 * self._raw_initial
+        # Raw water never drops below its initial levels, so the clarity reference levels are fixed
+        self._max_solids = self.raw_water_quality.get_contaminant_level("Suspended Solids")
+        self._max_organics = self.raw_water_quality.get_contaminant_level("Organic Chemicals")
+        self._solids_idx = self.raw_water_quality.name_to_idx.get("Suspended Solids")
+        self._organics_idx = self.raw_water_quality.name_to_idx.get("Organic Chemicals")
+        self._distilled_current = self.distilled_water_quality.current
+        self._update_distillation_factor()
+        # All water states share the raw water's contaminant order
+        self._name_unit_pairs = list(zip(self.raw_water_quality.names, self.raw_water_quality.units))
+
+        self._last_display_key = None
         self._update_contaminant_display("Initial Water Quality", self.raw_water_quality)
         self.status_label.text = "Simulating water purification...\n"
         self.clarity_label.text = "Clarity: 0.00 (Dirty)"
+        self._last_clarity_key = None
         Clock.schedule_interval(self.simulate_step, 0.5) # Faster for demo
 
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _build_dist_dict(temperature):
+        """Returns (evaporation_eff, condensation_eff, ((name, percentage_removal), ...))
+           for the given temperature. Cached, as it only depends on the temperature.
+        """
+        evaporation_eff = max(0.01, min(1.0, 0.1 + (temperature - 25) * 0.02))
+        condensation_eff = max(0.01, min(1.0, 0.6 + (temperature - 25) * 0.01))
+        removal = tuple(
+            (name, dist_eff * (evaporation_eff + condensation_eff) / 2 * 100) # Adjust percentage by process effectiveness
+            for name, dist_eff in distillation_process.efficiency.items()
+        )
+        return evaporation_eff, condensation_eff, removal
+
+    def _update_distillation_factor(self):
+        """Caches the temperature-dependent evaporation/condensation efficiencies
+           and the resulting per-contaminant distillation factor.
+           Call this whenever self.temperature changes.
+        """
+        self._evaporation_eff, self._condensation_eff, removal = self._build_dist_dict(round(self.temperature, 2))
+        self._dist_factor = self.raw_water_quality.removal_factor(dict(removal))
+        # Filtration and distillation are applied back to back, so fuse them into one factor
+        self._total_factor = self._combined_filter_factor * self._dist_factor
+        self._distillation_message = (f"Distillation (Evaporation: {self._evaporation_eff:.2f}, "
+                                      f"Condensation: {self._condensation_eff:.2f}) applied.\n")
+
     def _update_contaminant_display(self, title, water_quality_obj):
         """Updates the label showing contaminant levels."""
-        display_text = f"{title}:\n"
-        for name, level in water_quality_obj.get_all_levels().items():
-            cont = water_quality_obj.contaminants[name]
-            display_text += f"  {name}: {level:.2f} {cont.unit}\n"
-        self.contaminant_display_label.text = display_text
+        # Only reformat when a level changes at the displayed 2-decimal precision
+        levels = water_quality_obj.current
+        key = (title, np.rint(levels * 100).tobytes())
+        if key == self._last_display_key:
+            return
+        self._last_display_key = key
+        lines = [f"  {name}: {level:.2f} {unit}\n"
+                 for (name, unit), level in zip(self._name_unit_pairs, levels)]
+        self.contaminant_display_label.text = f"{title}:\n" + "".join(lines)
 
     def calculate_clarity(self):
         """Calculates clarity based on residual suspended solids and organics."""
         # Lower levels of these mean higher clarity
-        max_solids = self.raw_water_quality.get_contaminant_level("Suspended Solids")
-        max_organics = self.raw_water_quality.get_contaminant_level("Organic Chemicals")
+        max_solids = self._max_solids
+        max_organics = self._max_organics
 
-        current_solids = self.distilled_water_quality.get_contaminant_level("Suspended Solids")
-        current_organics = self.distilled_water_quality.get_contaminant_level("Organic Chemicals")
+        distilled = self._distilled_current
+        current_solids = distilled[self._solids_idx] if self._solids_idx is not None else 0.0
+        current_organics = distilled[self._organics_idx] if self._organics_idx is not None else 0.0
 
         # Avoid division by zero if initial levels were 0
         solids_clarity = 1.0 - (current_solids / max_solids if max_solids > 0 else 0)
@@ -200,85 +357,61 @@ class SolarDistillationSimulator(BoxLayout):
 
         # Simple weighted average for overall clarity
         clarity = (solids_clarity * 0.6) + (organics_clarity * 0.4)
-        return np.clip(clarity, 0.0, 1.0) # Ensure it's between 0 and 1
+        return 0.0 if clarity < 0.0 else 1.0 if clarity > 1.0 else clarity # Ensure it's between 0 and 1
 
     def simulate_step(self, dt):
         if not self.sim_running:
             return False
 
-        self.time_step += 1
-        step_message = f"--- Step: {self.time_step} ---\n"
-        step_message += f"Current Temperature: {self.temperature:.1f}°C\n"
+        # Bind the per-step state to locals once (cheaper than repeated attribute lookups)
+        raw = self._raw_current
+        init = self._raw_initial
+        dist = self._distilled_current
+        total = self._total_factor
+        drawn = self._capillary_drawn
 
-        # 1. Simulate Capillary Action (Soil/Sand)
-        capillary_draw_rate = 0.0 # How much new 'bad water' is introduced per step
-        for material in self.filtration_layers:
-            if material.draw_moisture and self.ground_moisture_level > 0:
-                # Simulate drawing up new raw water from the ground based on material's flow
-                # This will increase the contaminant levels of the 'raw' water slightly
-                draw_amount = 0.05 * material.effect_on_flow # Adjust for realism
-                if self.ground_moisture_level - draw_amount < 0:
-                    draw_amount = self.ground_moisture_level
-                self.ground_moisture_level -= draw_amount
-                capillary_draw_rate += draw_amount # Accumulate how much was drawn
-
-                # If new water is drawn, re-introduce a small portion of initial contaminants
-                # This makes the simulation run longer before reaching 'clear' if ground moisture is present
-                for name, initial_cont in self.raw_water_quality.contaminants.items():
-                    # For simplicity, let's say 1% of the initial level is added back if water is drawn
-                    # This simulates continuous contamination from the ground if not completely sealed
-                    re_contamination_amount = initial_cont.initial_level * 0.01 * (draw_amount / 0.05)
-                    self.raw_water_quality.contaminants[name].current_level = min(
-                        initial_cont.initial_level, # Don't exceed initial bad water level
-                        self.raw_water_quality.contaminants[name].current_level + re_contamination_amount
-                    )
-                step_message += f"Capillary action drawing water from ground ({draw_amount:.2f} units). Ground moisture: {self.ground_moisture_level:.1f}\n"
-
-        # Make a copy for physical filtration, so original raw water remains for capillary re-introduction
-        self.filtered_water_quality = self.raw_water_quality.copy()
-        step_message += "Applying Physical Filtration (Gravel, Sand, Charcoal):\n"
-        for material in self.filtration_layers:
-            self.filtered_water_quality.apply_removal(material.efficiency)
-            step_message += f"  - Applied {material.name} filter. Flow effect: {material.effect_on_flow:.1f}\n"
-
-        # 2. Simulate Evaporation & Condensation (Distillation)
-        # Distillation is highly effective
-        evaporation_eff = np.clip(0.1 + (self.temperature - 25) * 0.02, 0.01, 1.0)
-        condensation_eff = np.clip(0.6 + (self.temperature - 25) * 0.01, 0.01, 1.0)
-
-        # The distillation process acts on the already filtered water
-        self.distilled_water_quality = self.filtered_water_quality.copy()
-        distillation_removal_dict = {
-            name: dist_eff * (evaporation_eff + condensation_eff) / 2 * 100 # Adjust percentage by process effectiveness
-            for name, dist_eff in distillation_process.efficiency.items()
-        }
-        self.distilled_water_quality.apply_removal(distillation_removal_dict)
-        step_message += f"Distillation (Evaporation: {evaporation_eff:.2f}, Condensation: {condensation_eff:.2f}) applied.\n"
+        self.time_step += 1
+        parts = [f"--- Step: {self.time_step} ---\nCurrent Temperature: {self.temperature:.1f}°C\n"]
+
+        # 1. Simulate Capillary Action (Soil/Sand), 2. physical filtration and distillation
+        # Drawing new raw water from the ground makes the simulation run longer before reaching 'clear'
+        # The kernel takes the moisture as a plain float and returns the updated value
+        ground_moisture = self.ground_moisture_level
+        self.ground_moisture_level = _tick(
+            raw, init, dist, total, ground_moisture, self._capillary_draw_rates, drawn
+        )
+        for draw_amount in drawn:
+            if draw_amount > 0:
+                ground_moisture -= draw_amount
+                parts.append(f"Capillary action drawing water from ground ({draw_amount:.2f} units). Ground moisture: {ground_moisture:.1f}\n")
+
+        parts.append(self._filtration_message)
+        # Distillation is highly effective (efficiencies cached in start_simulation)
+        parts.append(self._distillation_message)
 
         # Update clarity based on final distilled water quality
         current_clarity = self.calculate_clarity()
-        clarity_status = ""
-        if current_clarity < 0.3:
-            clarity_status = "(Very Dirty)"
-        elif current_clarity < 0.6:
-            clarity_status = "(Cloudy)"
-        elif current_clarity < 0.9:
-            clarity_status = "(Clearing Up)"
-        else:
-            clarity_status = "(Clear!)"
+        clarity_bucket = bisect_right(self.CLARITY_THRESHOLDS, current_clarity)
 
-        self.clarity_label.text = f"Clarity: {current_clarity:.2f} {clarity_status}"
-        self.status_label.text = step_message
+        # Only reformat (and re-render) when the 2-decimal value or the status changes;
+        # the key just detects changes, the text is always formatted from the value itself
+        clarity_key = (round(current_clarity * 100), clarity_bucket)
+        if clarity_key != self._last_clarity_key:
+            self._last_clarity_key = clarity_key
+            self.clarity_label.text = f"Clarity: {current_clarity:.2f} {self.CLARITY_STATUSES[clarity_bucket]}"
+        self.status_label.text = "".join(parts)
 
-        # Update contaminant display
-        self._update_contaminant_display("Distilled Water Quality", self.distilled_water_quality)
+        # Update contaminant display (every few steps, the simulation itself still runs every step)
+        if self.time_step % self.CONTAMINANT_DISPLAY_INTERVAL == 0:
+            self._update_contaminant_display("Distilled Water Quality", self.distilled_water_quality)
 
         # Check for completion
         # Define 'clear' as most contaminants being very low
-        is_clear = all(self.distilled_water_quality.get_contaminant_level(c_name) < (c_cont.initial_level * 0.01)
-                       for c_name, c_cont in self.raw_water_quality.contaminants.items())
+        # (distilled water is a copy of the raw water, so both share the same contaminant order)
+        is_clear = bool(np.all(dist < self._clear_thresholds))
 
         if is_clear and current_clarity >= 0.95:
+            self._update_contaminant_display("Distilled Water Quality", self.distilled_water_quality)
             self.status_label.text += "\nWater is now clear and pure! Simulation complete."
             self.sim_running = False
             Clock.unschedule(self.simulate_step) # Explicitly unschedule
@@ -295,21 +428,16 @@ class SolarDistillationApp(App):
 
 if __name__ == "__main__":
     print("--- Filtration Materials Data (for reference) ---")
-    print(charcoal_filter.name)
-    print(f"  Description: {charcoal_filter.description}")
-    print(f"  Efficiencies: {charcoal_filter.efficiency}")
-    print(f"  Flow Effect: {charcoal_filter.effect_on_flow}\n")
-
-    print(gravel_filter.name)
-    print(f"  Description: {gravel_filter.description}")
-    print(f"  Efficiencies: {gravel_filter.efficiency}")
-    print(f"  Flow Effect: {gravel_filter.effect_on_flow}\n")
-
-    print(sand_filter.name)
-    print(f"  Description: {sand_filter.description}")
-    print(f"  Efficiencies: {sand_filter.efficiency}")
-    print(f"  Flow Effect: {sand_filter.effect_on_flow}")
-    print(f"  Draw Moisture (Capillary): {sand_filter.draw_moisture}\n")
+    for material in filtration_materials:
+        lines = [
+            material.name,
+            f"  Description: {material.description}",
+            f"  Efficiencies: {material.efficiency}",
+            f"  Flow Effect: {material.effect_on_flow}",
+        ]
+        if material.draw_moisture:
+            lines.append(f"  Draw Moisture (Capillary): {material.draw_moisture}")
+        print("\n".join(lines) + "\n")
 
     print("--------------------------------------------------\n")
 